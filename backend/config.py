@@ -35,6 +35,9 @@ class Settings(BaseSettings):
     # Frontend URL
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:4888")
 
+    # Magic tokens: limpieza periódica de expirados
+    TOKEN_CLEANUP_INTERVAL_SECONDS: int = int(os.getenv("TOKEN_CLEANUP_INTERVAL_SECONDS", "600"))
+
     # Admin defaults
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "admin")
     ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "admin123")
@@ -43,6 +46,7 @@ class Settings(BaseSettings):
     # Paths
     DATA_DIR: str = os.path.join(os.path.dirname(__file__), "data")
     UPLOADS_DIR: str = os.path.join(os.path.dirname(__file__), "uploads")
+    CACHE_DIR: str = os.path.join(os.path.dirname(__file__), "cache")
 
     # Preflight defaults
     BLEED_TOLERANCE_MM: float = 2.5
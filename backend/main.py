@@ -2,20 +2,55 @@
 Remote PDF Review — Backend
 FastAPI application entry point.
 """
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
 import uvicorn
 
 from config import settings
+from services.json_store import ORJSON_AVAILABLE
+
+if ORJSON_AVAILABLE:
+    # Serializa las respuestas en C directamente a bytes (proyectos con preflight son grandes)
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+else:
+    DefaultResponse = JSONResponse
+
+
+async def _token_cleanup_loop():
+    """Limpieza periódica de magic tokens expirados; un fallo no detiene el bucle"""
+    from services.token_service import token_service
+
+    while True:
+        await asyncio.sleep(settings.TOKEN_CLEANUP_INTERVAL_SECONDS)
+        try:
+            removed = token_service.cleanup_expired()
+            if removed:
+                print(f"🧹 {removed} token(s) expirado(s) eliminado(s)")
+        except Exception as e:
+            print(f"❌ Error limpiando tokens expirados: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    task = asyncio.create_task(_token_cleanup_loop())
+    try:
+        yield
+    finally:
+        task.cancel()
 
 
 def create_app() -> FastAPI:
     app = FastAPI(
         title="Remote PDF Review",
         description="Sistema de revisión remota de artes finales PDF",
-        version="1.0.0"
+        version="1.0.0",
+        default_response_class=DefaultResponse,
+        lifespan=lifespan
     )
 
     # CORS
@@ -40,11 +40,13 @@ async def login(request: LoginRequest):
             detail=message
         )
 
+    # user_data es nuevo en cada login: se puede sacar el token sin copiar
+    token = user_data.pop("token")
     return LoginResponse(
         success=True,
         message=message,
-        token=user_data["token"],
-        user={k: v for k, v in user_data.items() if k != "token"}
+        token=token,
+        user=user_data
     )
 
 
@@ -4,7 +4,8 @@ Rutas de gestión de proyectos: CRUD, upload de PDFs, preflight, comentarios.
 import os
 import uuid
 from pathlib import Path
-from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File
+import aiofiles
+from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File, Request, Response
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
 
@@ -16,6 +17,9 @@ from models.pdf_preflight import PreflightResponse
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
+# Los PDFs de imprenta pueden ocupar cientos de MB: se copian a disco por bloques
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 class CreateProjectRequest(BaseModel):
     name: str
@@ -39,7 +43,8 @@ class AddCommentRequest(BaseModel):
 async def list_projects(current_user: dict = Depends(get_current_user)):
     """Lista proyectos (admin: todos, client: los suyos)"""
     if current_user["role"] == "admin":
-        return project_service.get_all_projects()
+        # Bytes ya serializados: sin jsonable_encoder ni encode por petición
+        return Response(content=project_service.get_all_projects_json(), media_type="application/json")
     return project_service.get_projects_for_user(current_user["user_id"])
 
 
@@ -90,6 +95,8 @@ async def update_project_status(
 async def delete_project(project_id: str, current_user: dict = Depends(get_current_admin)):
     """Elimina un proyecto (solo admin)"""
     if project_service.delete_project(project_id):
+        from services.pdf_thumbnail_service import pdf_thumbnail_service
+        pdf_thumbnail_service.remove_cached(project_id)
         return {"success": True, "message": "Proyecto eliminado"}
     raise HTTPException(status_code=404, detail="Proyecto no encontrado")
 
@@ -116,18 +123,18 @@ async def upload_pdf(
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
 
     # Save file
-    upload_dir = os.path.join(settings.UPLOADS_DIR, project_id)
-    os.makedirs(upload_dir, exist_ok=True)
+    upload_dir = project_service.get_project_upload_dir(project_id)
 
     # Use unique filename to avoid collisions
     safe_filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
     filepath = os.path.join(upload_dir, safe_filename)
 
-    file_content = await file.read()
-    with open(filepath, "wb") as f:
-        f.write(file_content)
-
-    file_size = len(file_content)
+    # Escritura en el threadpool de aiofiles: no bloquea el event loop con PDFs grandes
+    file_size = 0
+    async with aiofiles.open(filepath, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await f.write(chunk)
+            file_size += len(chunk)
 
     # Register in project
     pdf_entry = project_service.add_pdf(
@@ -159,6 +166,8 @@ async def remove_pdf(
         raise HTTPException(status_code=403, detail="Sin acceso")
 
     if project_service.remove_pdf(project_id, filename):
+        from services.pdf_thumbnail_service import pdf_thumbnail_service
+        pdf_thumbnail_service.remove_cached(project_id, filename)
         return {"success": True, "message": "PDF eliminado"}
     raise HTTPException(status_code=404, detail="PDF no encontrado")
 
@@ -258,6 +267,8 @@ async def get_pdf_page_thumbnail(
     project_id: str,
     filename: str,
     page_number: int,
+    request: Request,
+    response: Response,
     width: int = 400,
     current_user: dict = Depends(get_current_user)
 ):
@@ -275,7 +286,16 @@ async def get_pdf_page_thumbnail(
     if not pdf_path.exists():
         raise HTTPException(status_code=404, detail="PDF no encontrado")
 
+    # Los PDFs subidos no se sobrescriben: el thumbnail de (mtime, página, ancho) es inmutable
+    cache_key = pdf_thumbnail_service.get_cache_key(pdf_path, page_number, width)
+    etag = f'"{cache_key}"'
+    if cache_key and request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
     result = pdf_thumbnail_service.get_page_thumbnail(pdf_path, page_number, width)
+    if cache_key and not result.get("placeholder"):
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
     return result
 
 
@@ -2,6 +2,7 @@
 Rutas de gestión de usuarios (admin).
 """
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
 
@@ -100,9 +101,11 @@ async def invite_user(
             project_name = project.get("name", "")
 
     # Send email
-    email_sent = email_service.send_invitation(
+    # SMTP es bloqueante: fuera del event loop
+    email_sent = await run_in_threadpool(
+        email_service.send_invitation,
         to_email=user["email"],
-        to_name=user.get("full_name", user["username"]),
+        to_name=user.get("full_name") or user["username"],
         magic_url=token_data["magic_url"],
         project_name=project_name,
         custom_message=request.custom_message
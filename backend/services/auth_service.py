@@ -2,7 +2,9 @@
 Servicio de autenticación para Remote.
 JWT + bcrypt. Patrón W2P jwt.py + MIS auth_service.py
 """
-from datetime import datetime, timedelta
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional, Dict, Any, Tuple
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
@@ -27,20 +29,32 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
 
-def verify_token(token: str) -> Optional[Dict[str, Any]]:
-    """Verify and decode a JWT token"""
+@lru_cache(maxsize=1024)
+def _decode_token(token: str) -> Optional[Dict[str, Any]]:
+    """Decode + firma HMAC una sola vez por token; el mismo JWT llega en cada petición"""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
     except JWTError:
         return None
 
 
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    """Verify and decode a JWT token"""
+    payload = _decode_token(token)
+    if payload is None:
+        return None
+    # El payload puede venir de caché: la expiración se comprueba en cada uso
+    exp = payload.get("exp")
+    if exp is not None and exp <= time.time():
+        return None
+    return payload
+
+
 def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any]:
     """FastAPI dependency to get the current authenticated user"""
     credentials_exception = HTTPException(
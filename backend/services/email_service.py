@@ -2,7 +2,10 @@
 Servicio de email para envío de invitaciones con magic link.
 Patrón MIS email_service.py simplificado (solo SMTP).
 """
+import atexit
 import smtplib
+import threading
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from datetime import datetime
@@ -14,8 +17,18 @@ from config import settings
 class EmailService:
     """Servicio de email SMTP para invitaciones"""
 
+    # Sin timeout, una conexión medio cerrada bloquea el envío (y el event loop) indefinidamente
+    TIMEOUT_SECONDS = 30
+    # Más allá de esto el servidor suele haber cerrado la conexión: se abre otra sin sondearla
+    MAX_IDLE_SECONDS = 60
+
     def __init__(self):
-        pass
+        # Conexión SMTP reutilizada entre envíos (evita TLS + login por email)
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._from_header = f"{settings.SMTP_FROM_NAME} <{settings.SMTP_FROM_ADDRESS or settings.SMTP_USERNAME}>"
+        atexit.register(self.close)
 
     @property
     def is_configured(self) -> bool:
@@ -24,12 +37,59 @@ class EmailService:
 
     def _create_connection(self):
         """Crea conexión SMTP"""
-        server = smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT)
+        server = smtplib.SMTP(settings.SMTP_SERVER, settings.SMTP_PORT, timeout=self.TIMEOUT_SECONDS)
         if settings.SMTP_USE_TLS:
             server.starttls()
         server.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
         return server
 
+    def _get_connection(self) -> smtplib.SMTP:
+        """Devuelve la conexión abierta si sigue viva; si no, abre otra"""
+        if self._server is not None:
+            if time.monotonic() - self._last_used < self.MAX_IDLE_SECONDS:
+                try:
+                    if self._server.noop()[0] == 250:
+                        return self._server
+                except OSError:  # SMTPException y timeouts de socket
+                    pass
+            self._drop_connection()
+        self._server = self._create_connection()
+        return self._server
+
+    def _drop_connection(self):
+        if self._server is not None:
+            try:
+                self._server.close()
+            except Exception:
+                pass
+            self._server = None
+
+    def _send(self, msg: MIMEMultipart):
+        """Envía por la conexión compartida; reintenta una vez si el servidor la cerró"""
+        with self._lock:
+            try:
+                try:
+                    self._get_connection().send_message(msg)
+                except smtplib.SMTPServerDisconnected:
+                    # Solo se reintenta si la conexión estaba cerrada: otro error podría duplicar el envío
+                    self._drop_connection()
+                    self._get_connection().send_message(msg)
+            except OSError:
+                # Estado de la conexión desconocido (timeout, rechazo...): no se reutiliza
+                self._drop_connection()
+                raise
+            self._last_used = time.monotonic()
+
+    def close(self):
+        """Cierra la conexión SMTP compartida"""
+        with self._lock:
+            if self._server is not None:
+                try:
+                    self._server.quit()
+                except Exception:
+                    pass
+                self._server = None
+
     def send_invitation(
         self,
         to_email: str,
@@ -58,14 +118,12 @@ class EmailService:
             )
 
             msg = MIMEMultipart()
-            msg["From"] = f"{settings.SMTP_FROM_NAME} <{settings.SMTP_FROM_ADDRESS or settings.SMTP_USERNAME}>"
+            msg["From"] = self._from_header
             msg["To"] = f"{to_name} <{to_email}>" if to_name else to_email
             msg["Subject"] = subject
             msg.attach(MIMEText(html_body, "html", "utf-8"))
 
-            server = self._create_connection()
-            server.send_message(msg)
-            server.quit()
+            self._send(msg)
 
             print(f"✅ Email de invitación enviado a {to_email}")
             return True
@@ -81,7 +139,7 @@ class EmailService:
 
         try:
             msg = MIMEMultipart()
-            msg["From"] = f"{settings.SMTP_FROM_NAME} <{settings.SMTP_FROM_ADDRESS or settings.SMTP_USERNAME}>"
+            msg["From"] = self._from_header
             msg["To"] = to_email
             msg["Subject"] = "🧪 Test - Remote PDF Review"
             msg.attach(MIMEText(
@@ -89,9 +147,7 @@ class EmailService:
                 "html", "utf-8"
             ))
 
-            server = self._create_connection()
-            server.send_message(msg)
-            server.quit()
+            self._send(msg)
             return True
 
         except Exception as e:
@@ -0,0 +1,268 @@
+"""
+Almacén JSON compartido por los servicios.
+Snapshot (lista JSON) + log JSONL de solo-anexado con los eventos posteriores.
+Cada mutación escribe una línea al log; al cargar se reaplica el log sobre el
+snapshot y, cuando el log crece demasiado, se compacta en un snapshot nuevo.
+"""
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Encoder compacto reutilizado: json.dumps crea uno nuevo en cada llamada con opciones
+_ENCODE = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def _dumps(obj: Any, pretty: bool = False) -> bytes:
+    """Serializa a bytes UTF-8 (orjson si está disponible)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if pretty else None)
+    if pretty:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    # Sin indentación: ~2-3x menos bytes y el encoder usa el camino rápido en C
+    return _ENCODE(obj).encode("utf-8")
+
+
+def _loads(data: bytes) -> Any:
+    """Deserializa bytes; orjson.JSONDecodeError hereda de json.JSONDecodeError"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _atomic_write_json(path: str, obj: Any, fsync: bool = False, pretty: bool = False):
+    """Escribe a un temporal y lo renombra: un corte nunca deja el fichero a medias"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    data = _dumps(obj, pretty=pretty)
+    try:
+        with open(tmp, "wb") as f:
+            # Una sola escritura: json.dump hace un f.write por cada token
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class JsonlStore:
+    """Snapshot JSON + log de eventos JSONL con caché en memoria"""
+
+    # Compactar cuando el log supere COMPACT_RATIO × snapshot (y un mínimo)
+    COMPACT_RATIO = 4
+    COMPACT_MIN_BYTES = 64 * 1024
+    # El rename ya es atómico; fsync solo si se quiere durabilidad ante cortes de luz
+    FSYNC = False
+    # Segundos que esperan los eventos diferidos (append(defer=True)) antes de escribirse
+    FLUSH_DELAY = 2.0
+
+    def __init__(self, data_file: str, apply_event: Callable[[List[Dict[str, Any]], Dict[str, Any]], None]):
+        """
+        apply_event(items, event) aplica un evento sobre la lista en memoria.
+        Se usa tanto en las mutaciones como al reaplicar el log, y debe ser
+        idempotente: el log puede sobrevivir a un snapshot que ya lo incluye.
+        """
+        self.data_file = data_file
+        self.log_file = os.path.splitext(data_file)[0] + ".log"
+        self._apply_event = apply_event
+        self._lock = threading.RLock()
+        self._log_fp = None
+        self._pending: List[bytes] = []
+        self._flush_timer = None
+        self._txn_depth = 0
+        self._cache = None
+        self._cache_stat = None
+        # Se incrementa con cada cambio del estado en memoria (evento, snapshot o recarga)
+        self.version = 0
+        self._dumped = None
+        atexit.register(self.flush)
+
+    def _file_stat(self):
+        """(mtime, tamaño) de snapshot y log; cualquier cambio invalida la caché"""
+        stats = []
+        for path in (self.data_file, self.log_file):
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stats.append(None)
+        return tuple(stats)
+
+    def _close_log(self):
+        if self._log_fp is not None:
+            self._log_fp.close()
+            self._log_fp = None
+
+    def _repair_log_tail(self):
+        """
+        Recorta una última línea sin "\n" (escritura interrumpida).
+        Si se dejara, el siguiente append O_APPEND quedaría pegado a ella y
+        ese evento también se perdería al reaplicar el log.
+        """
+        try:
+            with open(self.log_file, "r+b") as f:
+                end = f.seek(0, os.SEEK_END)
+                if end == 0:
+                    return
+                f.seek(end - 1)
+                if f.read(1) == b"\n":
+                    return
+                # Buscar hacia atrás el último salto de línea completo
+                pos = end
+                while pos > 0:
+                    start = max(0, pos - 64 * 1024)
+                    f.seek(start)
+                    idx = f.read(pos - start).rfind(b"\n")
+                    if idx != -1:
+                        f.truncate(start + idx + 1)
+                        return
+                    pos = start
+                f.truncate(0)
+        except FileNotFoundError:
+            pass
+
+    def exists(self) -> bool:
+        return os.path.exists(self.data_file)
+
+    def load(self) -> List[Dict[str, Any]]:
+        """Devuelve la lista en memoria; relee snapshot + log solo si cambiaron en disco"""
+        with self._lock:
+            stat = self._file_stat()
+            if self._cache is not None and stat == self._cache_stat:
+                return self._cache
+
+            # Otro proceso ha escrito: lo pendiente va al log antes de releer
+            self.flush()
+            # El handle del log puede apuntar a un fichero ya compactado
+            self._close_log()
+            self._repair_log_tail()
+            stat = self._file_stat()
+            try:
+                with open(self.data_file, "rb") as f:
+                    items = _loads(f.read())
+            except (json.JSONDecodeError, FileNotFoundError):
+                items = []
+
+            if stat[1] is not None:
+                with open(self.log_file, "rb") as f:
+                    for line in f:
+                        try:
+                            event = _loads(line)
+                        except json.JSONDecodeError:
+                            continue  # Línea truncada por una escritura interrumpida
+                        self._apply_event(items, event)
+
+            self._cache, self._cache_stat = items, stat
+            self.version += 1
+            return items
+
+    def save(self, items: List[Dict[str, Any]]):
+        """Escribe un snapshot completo de forma atómica y descarta el log"""
+        with self._lock:
+            _atomic_write_json(self.data_file, items, fsync=self.FSYNC)
+
+            # Los eventos diferidos ya están aplicados en items
+            self._pending.clear()
+            self._close_log()
+            if os.path.exists(self.log_file):
+                os.remove(self.log_file)
+            self._cache, self._cache_stat = items, self._file_stat()
+            self.version += 1
+
+    def dump_bytes(self) -> bytes:
+        """Estado actual serializado, reutilizado hasta el siguiente cambio"""
+        with self._lock:
+            items = self.load()
+            if self._dumped is None or self._dumped[0] != self.version:
+                self._dumped = (self.version, _dumps(items))
+            return self._dumped[1]
+
+    def export_pretty(self, path: Optional[str] = None) -> str:
+        """Vuelca el estado actual indentado, para depurar (el snapshot va compacto)"""
+        path = path or os.path.splitext(self.data_file)[0] + ".pretty.json"
+        with self._lock:
+            _atomic_write_json(path, self.load(), pretty=True)
+        return path
+
+    def append(self, event: Dict[str, Any], items: Optional[List[Dict[str, Any]]] = None, defer: bool = False):
+        """
+        Aplica un evento en memoria y lo anexa al log: O(tamaño del evento).
+        items: lista ya obtenida con load() en la misma operación, para no recargar.
+        defer: el evento se escribe en el siguiente flush (agrupado) en vez de ahora.
+        """
+        with self._lock:
+            if items is None:
+                items = self.load()
+            self._apply_event(items, event)
+            self.version += 1
+            self._pending.append(_dumps(event) + b"\n")
+            if self._txn_depth:
+                return  # Se escribe al cerrar la transacción
+            if defer:
+                self._schedule_flush()
+            else:
+                self.flush()
+
+    def flush(self):
+        """Escribe los eventos pendientes en el log con un único write()"""
+        with self._lock:
+            if not self._pending:
+                return
+            # Si el disco cambió por otro lado, la caché no se da por válida tras escribir
+            in_sync = self._file_stat() == self._cache_stat
+            if not in_sync:
+                # Otro proceso pudo compactar y borrar el log: el handle abierto
+                # apuntaría al fichero desvinculado y lo escrito se perdería
+                self._close_log()
+
+            if self._log_fp is None:
+                self._repair_log_tail()
+                # Sin buffer: cada flush es un único write() con O_APPEND
+                self._log_fp = open(self.log_file, "ab", buffering=0)
+            self._log_fp.write(b"".join(self._pending))
+            self._pending.clear()
+            if not in_sync:
+                return
+
+            self._cache_stat = self._file_stat()
+            snapshot_stat, log_stat = self._cache_stat
+            snapshot_size = snapshot_stat[1] if snapshot_stat else 0
+            if log_stat and log_stat[1] > max(self.COMPACT_MIN_BYTES, self.COMPACT_RATIO * snapshot_size):
+                self.save(self._cache)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias mutaciones en un único write() del log al salir.
+        Anidable; el lock se mantiene durante todo el bloque.
+        """
+        with self._lock:
+            self._txn_depth += 1
+            try:
+                yield self
+            finally:
+                self._txn_depth -= 1
+                if not self._txn_depth:
+                    self.flush()
+
+    def _schedule_flush(self):
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.FLUSH_DELAY, self._timed_flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._flush_timer = None
+            self.flush()
@@ -20,6 +20,13 @@ try:
 except ImportError:
     PYPDF2_AVAILABLE = False
 
+# Matriz identidad; las CTM son tuplas inmutables y "q" apila la misma sin copiarla
+IDENTITY_CTM = (1, 0, 0, 1, 0, 0)
+
+PT_TO_MM = 0.352778
+# Claves del FontDescriptor que indican fuente embebida
+FONT_FILE_KEYS = ("/FontFile", "/FontFile2", "/FontFile3")
+
 
 class PreflightCheck:
     """Representa un chequeo individual de preflight"""
@@ -47,11 +54,14 @@ class PreflightResult:
     """Resultado completo del análisis preflight"""
     def __init__(self):
         self.checks: List[PreflightCheck] = []
+        # Mismos checks agrupados por severidad al añadirlos (status y to_dict sin refiltrar)
+        self._by_severity: Dict[str, List[PreflightCheck]] = {"error": [], "warning": [], "info": []}
         self.summary: Dict[str, Any] = {}
         self.analyzed_at: str = datetime.now().isoformat()
 
     def add_check(self, check: PreflightCheck):
         self.checks.append(check)
+        self._by_severity[check.severity].append(check)
 
     def add_error(self, code: str, message: str, page: Optional[int] = None, details: Optional[Dict] = None):
         self.add_check(PreflightCheck(code, message, "error", page, details))
@@ -64,11 +74,9 @@ class PreflightResult:
 
     @property
     def status(self) -> str:
-        has_errors = any(c.severity == "error" for c in self.checks)
-        has_warnings = any(c.severity == "warning" for c in self.checks)
-        if has_errors:
+        if self._by_severity["error"]:
             return "FAIL"
-        elif has_warnings:
+        elif self._by_severity["warning"]:
             return "WARN"
         return "PASS"
 
@@ -77,9 +85,9 @@ class PreflightResult:
             "status": self.status,
             "analyzed_at": self.analyzed_at,
             "summary": self.summary,
-            "errors": [c.to_dict() for c in self.checks if c.severity == "error"],
-            "warnings": [c.to_dict() for c in self.checks if c.severity == "warning"],
-            "info": [c.to_dict() for c in self.checks if c.severity == "info"]
+            "errors": [c.to_dict() for c in self._by_severity["error"]],
+            "warnings": [c.to_dict() for c in self._by_severity["warning"]],
+            "info": [c.to_dict() for c in self._by_severity["info"]]
         }
 
 
@@ -171,11 +179,8 @@ class PdfPreflightService:
             # Transparency
             self._check_transparency(pdf, result)
 
-            # Images
-            self._check_images(pdf, result, min_dpi)
-
-            # Hairlines
-            self._check_hairlines(pdf, result, min_lw)
+            # Images + hairlines (un solo parseo del content stream por página)
+            self._check_content_streams(pdf, result, min_dpi, min_lw)
 
     def _check_pdfx_compliance(self, pdf, result: PreflightResult):
         try:
@@ -225,7 +230,8 @@ class PdfPreflightService:
             print(f"Error al verificar PDF/X: {e}")
 
     def _check_page_boxes(self, pdf, result: PreflightResult, bleed_tolerance_mm: float):
-        page_sizes = []
+        # dict como conjunto ordenado: sin recorrer la lista en cada página
+        page_sizes = {}
         has_trimbox = True
         has_bleedbox = True
 
@@ -234,11 +240,9 @@ class PdfPreflightService:
             if mediabox:
                 width_pts = float(mediabox[2]) - float(mediabox[0])
                 height_pts = float(mediabox[3]) - float(mediabox[1])
-                width_mm = round(width_pts * 0.352778, 2)
-                height_mm = round(height_pts * 0.352778, 2)
-                page_size = f"{width_mm}x{height_mm} mm"
-                if page_size not in page_sizes:
-                    page_sizes.append(page_size)
+                width_mm = round(width_pts * PT_TO_MM, 2)
+                height_mm = round(height_pts * PT_TO_MM, 2)
+                page_sizes[f"{width_mm}x{height_mm} mm"] = None
 
             trimbox = page.get("/TrimBox")
             if not trimbox:
@@ -256,8 +260,8 @@ class PdfPreflightService:
                 bleed_width = float(bleedbox[2]) - float(bleedbox[0])
                 bleed_height = float(bleedbox[3]) - float(bleedbox[1])
 
-                bleed_h = (bleed_width - trim_width) / 2 * 0.352778
-                bleed_v = (bleed_height - trim_height) / 2 * 0.352778
+                bleed_h = (bleed_width - trim_width) / 2 * PT_TO_MM
+                bleed_v = (bleed_height - trim_height) / 2 * PT_TO_MM
                 min_bleed = min(bleed_h, bleed_v)
 
                 if min_bleed < bleed_tolerance_mm:
@@ -268,6 +272,7 @@ class PdfPreflightService:
                         details={"bleed_h_mm": round(bleed_h, 2), "bleed_v_mm": round(bleed_v, 2)}
                     )
 
+        page_sizes = list(page_sizes)
         result.summary["page_sizes"] = page_sizes
         result.summary["has_trimbox"] = has_trimbox
         result.summary["has_bleedbox"] = has_bleedbox
@@ -276,7 +281,8 @@ class PdfPreflightService:
             result.add_warning("MIXED_PAGE_SIZES", f"Páginas de diferentes tamaños: {', '.join(page_sizes)}")
 
     def _check_fonts(self, pdf, result: PreflightResult):
-        fonts_info = {"embedded": [], "not_embedded": [], "subset": []}
+        # Las mismas fuentes se repiten en cada página: dicts como conjuntos ordenados
+        fonts_info = {"embedded": {}, "not_embedded": {}, "subset": {}}
 
         try:
             for i, page in enumerate(pdf.pages, start=1):
@@ -285,9 +291,8 @@ class PdfPreflightService:
 
                 for font_name, font_ref in fonts.items():
                     try:
+                        # pikepdf ya resuelve las referencias indirectas al iterar
                         font = font_ref
-                        if isinstance(font_ref, pikepdf.Object):
-                            font = pdf.get_object(font_ref.objgen) if hasattr(font_ref, 'objgen') else font_ref
 
                         base_font = str(font.get("/BaseFont", font_name)) if "/BaseFont" in font else str(font_name)
                         base_font = base_font.replace("/", "")
@@ -297,23 +302,26 @@ class PdfPreflightService:
 
                         if "/FontDescriptor" in font:
                             descriptor = font["/FontDescriptor"]
-                            is_embedded = any(key in descriptor for key in ["/FontFile", "/FontFile2", "/FontFile3"])
+                            is_embedded = any(key in descriptor for key in FONT_FILE_KEYS)
 
-                        if "+" in base_font and len(base_font.split("+")[0]) == 6:
+                        # Prefijo de subset: 6 letras + "+" (p. ej. ABCDEF+Helvetica)
+                        prefix, plus, _ = base_font.partition("+")
+                        if plus and len(prefix) == 6:
                             is_subset = True
                             is_embedded = True
 
                         if is_subset and base_font not in fonts_info["subset"]:
-                            fonts_info["subset"].append(base_font)
+                            fonts_info["subset"][base_font] = None
                         elif is_embedded and base_font not in fonts_info["embedded"]:
-                            fonts_info["embedded"].append(base_font)
+                            fonts_info["embedded"][base_font] = None
                         elif not is_embedded and base_font not in fonts_info["not_embedded"]:
-                            fonts_info["not_embedded"].append(base_font)
+                            fonts_info["not_embedded"][base_font] = None
                     except:
                         continue
         except Exception as e:
             print(f"Error al verificar fuentes: {e}")
 
+        fonts_info = {kind: list(names) for kind, names in fonts_info.items()}
         result.summary["fonts"] = fonts_info
 
         if fonts_info["not_embedded"]:
@@ -412,35 +420,47 @@ class PdfPreflightService:
         if has_transparency:
             result.add_info("TRANSPARENCY_DETECTED", f"Transparencias en página(s): {', '.join(map(str, transparency_pages))}", details={"pages": transparency_pages})
 
-    def _check_images(self, pdf, result: PreflightResult, min_image_dpi: int):
+    def _check_content_streams(self, pdf, result: PreflightResult, min_image_dpi: int, min_line_width_pt: float):
+        """
+        Imágenes (resolución efectiva) y hairlines en un único recorrido:
+        cada content stream se parsea una sola vez para ambos chequeos.
+        """
         low_res_images = []
+        hairline_issues = []
+        # Un fallo en los recursos de imagen solo desactiva el chequeo de imágenes
+        images_enabled = True
 
         try:
             for i, page in enumerate(pdf.pages, start=1):
-                resources = page.get("/Resources", {})
-                xobjects = resources.get("/XObject", {})
-                images_info = {}
-
-                for name, xobj in xobjects.items():
-                    if xobj.get("/Subtype") == "/Image":
-                        try:
-                            width = int(xobj.get("/Width", 0))
-                            height = int(xobj.get("/Height", 0))
-                            images_info[str(name)] = (width, height)
-                        except:
-                            pass
-
-                if not images_info:
-                    continue
-
                 try:
-                    ctm_stack = [[1, 0, 0, 1, 0, 0]]
+                    images_info = {}
+                    if images_enabled:
+                        try:
+                            resources = page.get("/Resources", {})
+                            xobjects = resources.get("/XObject", {})
+                            for name, xobj in xobjects.items():
+                                if xobj.get("/Subtype") == "/Image":
+                                    try:
+                                        width = int(xobj.get("/Width", 0))
+                                        height = int(xobj.get("/Height", 0))
+                                        images_info[str(name)] = (width, height)
+                                    except:
+                                        pass
+                        except Exception as e:
+                            print(f"Error analizando imágenes: {e}")
+                            images_enabled = False
+                            images_info = {}
+
+                    ctm_stack = [IDENTITY_CTM]
                     instructions = pikepdf.parse_content_stream(page)
+                    hairline_found = False
+                    # Escala del grosor de línea: solo cambia con la CTM (las tuplas se comparten entre q/Q)
+                    scale_ctm, line_scale = None, 1
 
                     for operands, operator in instructions:
                         op = str(operator)
                         if op == "q":
-                            ctm_stack.append(list(ctm_stack[-1]))
+                            ctm_stack.append(ctm_stack[-1])
                         elif op == "Q":
                             if len(ctm_stack) > 1:
                                 ctm_stack.pop()
@@ -448,39 +468,58 @@ class PdfPreflightService:
                             try:
                                 a, b, c, d, e, f = [float(x) for x in operands]
                                 cur = ctm_stack[-1]
-                                new_a = a * cur[0] + b * cur[2]
-                                new_b = a * cur[1] + b * cur[3]
-                                new_c = c * cur[0] + d * cur[2]
-                                new_d = c * cur[1] + d * cur[3]
-                                new_e = e * cur[0] + f * cur[2] + cur[4]
-                                new_f = e * cur[1] + f * cur[3] + cur[5]
-                                ctm_stack[-1] = [new_a, new_b, new_c, new_d, new_e, new_f]
+                                ctm_stack[-1] = (
+                                    a * cur[0] + b * cur[2], a * cur[1] + b * cur[3],
+                                    c * cur[0] + d * cur[2], c * cur[1] + d * cur[3],
+                                    e * cur[0] + f * cur[2] + cur[4], e * cur[1] + f * cur[3] + cur[5]
+                                )
                             except:
                                 pass
                         elif op == "Do":
-                            xobj_name = str(operands[0])
-                            if xobj_name in images_info:
-                                width, height = images_info[xobj_name]
-                                if width > 0 and height > 0:
-                                    ctm = ctm_stack[-1]
-                                    scale_x = math.hypot(ctm[0], ctm[1])
-                                    scale_y = math.hypot(ctm[2], ctm[3])
-                                    if scale_x == 0: scale_x = 1
-                                    if scale_y == 0: scale_y = 1
-
-                                    dpi_x = width / (scale_x / 72.0)
-                                    dpi_y = height / (scale_y / 72.0)
-                                    effective_dpi = min(dpi_x, dpi_y)
-
-                                    if effective_dpi < min_image_dpi:
-                                        low_res_images.append({
-                                            "page": i, "image": xobj_name,
-                                            "dpi": round(effective_dpi), "dims": f"{width}x{height}"
-                                        })
+                            try:
+                                xobj_name = str(operands[0])
+                                if xobj_name in images_info:
+                                    width, height = images_info[xobj_name]
+                                    if width > 0 and height > 0:
+                                        ctm = ctm_stack[-1]
+                                        scale_x = math.hypot(ctm[0], ctm[1])
+                                        scale_y = math.hypot(ctm[2], ctm[3])
+                                        if scale_x == 0: scale_x = 1
+                                        if scale_y == 0: scale_y = 1
+
+                                        dpi_x = width / (scale_x / 72.0)
+                                        dpi_y = height / (scale_y / 72.0)
+                                        effective_dpi = min(dpi_x, dpi_y)
+
+                                        if effective_dpi < min_image_dpi:
+                                            low_res_images.append({
+                                                "page": i, "image": xobj_name,
+                                                "dpi": round(effective_dpi), "dims": f"{width}x{height}"
+                                            })
+                            except:
+                                images_info = {}  # Se abandona el chequeo de imágenes en esta página
+                        elif op == "w" and not hairline_found:
+                            try:
+                                nominal_width = float(operands[0])
+                                ctm = ctm_stack[-1]
+                                if ctm is not scale_ctm:
+                                    scale_ctm = ctm
+                                    line_scale = (math.hypot(ctm[0], ctm[1]) + math.hypot(ctm[2], ctm[3])) / 2
+                                    if line_scale == 0: line_scale = 1
+                                effective_width = nominal_width * line_scale
+
+                                if 0 <= effective_width < min_line_width_pt:
+                                    # Solo se informa la primera por página
+                                    hairline_issues.append({"page": i, "width": round(effective_width, 3)})
+                                    hairline_found = True
+                                    if not images_info:
+                                        break  # Nada más que buscar en esta página
+                            except:
+                                pass
                 except:
                     pass
         except Exception as e:
-            print(f"Error analizando imágenes: {e}")
+            print(f"Error analizando content streams: {e}")
 
         if low_res_images:
             pages_affected = sorted(list(set(item["page"] for item in low_res_images)))
@@ -491,49 +530,6 @@ class PdfPreflightService:
                 details={"images": low_res_images}
             )
 
-    def _check_hairlines(self, pdf, result: PreflightResult, min_line_width_pt: float):
-        hairline_issues = []
-
-        try:
-            for i, page in enumerate(pdf.pages, start=1):
-                try:
-                    ctm_stack = [[1, 0, 0, 1, 0, 0]]
-                    instructions = pikepdf.parse_content_stream(page)
-
-                    for operands, operator in instructions:
-                        op = str(operator)
-                        if op == "q":
-                            ctm_stack.append(list(ctm_stack[-1]))
-                        elif op == "Q":
-                            if len(ctm_stack) > 1: ctm_stack.pop()
-                        elif op == "cm":
-                            try:
-                                a, b, c, d, e, f = [float(x) for x in operands]
-                                cur = ctm_stack[-1]
-                                ctm_stack[-1] = [
-                                    a * cur[0] + b * cur[2], a * cur[1] + b * cur[3],
-                                    c * cur[0] + d * cur[2], c * cur[1] + d * cur[3],
-                                    e * cur[0] + f * cur[2] + cur[4], e * cur[1] + f * cur[3] + cur[5]
-                                ]
-                            except: pass
-                        elif op == "w":
-                            try:
-                                nominal_width = float(operands[0])
-                                ctm = ctm_stack[-1]
-                                scale = (math.hypot(ctm[0], ctm[1]) + math.hypot(ctm[2], ctm[3])) / 2
-                                if scale == 0: scale = 1
-                                effective_width = nominal_width * scale
-
-                                if 0 <= effective_width < min_line_width_pt:
-                                    if not any(iss['page'] == i for iss in hairline_issues):
-                                        hairline_issues.append({"page": i, "width": round(effective_width, 3)})
-                            except:
-                                pass
-                except:
-                    pass
-        except Exception as e:
-            print(f"Error verificando hairlines: {e}")
-
         if hairline_issues:
             pages = sorted([h["page"] for h in hairline_issues])
             result.add_warning(
@@ -1,53 +1,165 @@
 """
 Servicio de proyectos con persistencia JSON.
 Cada proyecto contiene info del cliente, PDFs subidos, estado y comentarios.
+Las mutaciones se anexan como eventos al log JSONL del JsonlStore.
 """
 import uuid
-import json
 import os
 import shutil
+import threading
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 
 from config import settings
+from services.json_store import JsonlStore
 
 
 class ProjectService:
     """Gestión de proyectos con persistencia JSON"""
 
-    STATUSES = ["pending", "reviewing", "approved", "rejected", "completed"]
+    # Orden del flujo (para listar) y conjunto para validar en O(1)
+    STATUS_LIST = ("pending", "reviewing", "approved", "rejected", "completed")
+    STATUSES = frozenset(STATUS_LIST)
+
+    # op del log -> (lista del proyecto, campo clave del registro en el índice)
+    RECORD_OPS = {
+        "add_pdf": ("pdfs", "filename"),
+        "add_comment": ("comments", "comment_id"),
+    }
 
     def __init__(self):
         self.data_file = os.path.join(settings.DATA_DIR, "projects.json")
+        self.trash_dir = os.path.join(settings.UPLOADS_DIR, ".trash")
+        self._store = JsonlStore(self.data_file, self._apply_event)
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        # project_id -> {"pdfs": {filename: pdf}, "comments": {comment_id: comment}}
+        self._records: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._indexed = None
+        # Directorios de uploads ya creados: evita el makedirs en cada operación
+        self._known_dirs: set = set()
         self._ensure_data_file()
+        self._empty_trash_async()
 
     def _ensure_data_file(self):
         os.makedirs(settings.DATA_DIR, exist_ok=True)
         os.makedirs(settings.UPLOADS_DIR, exist_ok=True)
-        if not os.path.exists(self.data_file):
+        if not self._store.exists():
             self._save_projects([])
 
     def _load_projects(self) -> List[Dict[str, Any]]:
-        try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+        return self._store.load()
 
     def _save_projects(self, projects: List[Dict[str, Any]]):
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(projects, f, indent=2, ensure_ascii=False)
+        self._store.save(projects)
+
+    def transaction(self):
+        """Agrupa varias mutaciones en una sola escritura: with project_service.transaction(): ..."""
+        return self._store.transaction()
+
+    def _index(self, projects: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Índice project_id -> proyecto; se reconstruye si la lista se recargó de disco"""
+        if projects is not self._indexed:
+            self._by_id = {p["project_id"]: p for p in projects}
+            self._records = {p["project_id"]: self._record_index(p) for p in projects}
+            self._indexed = projects
+        return self._by_id
+
+    def _record_index(self, project: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        return {
+            # Proyectos antiguos pueden no tener pdfs/comments (igual que get_comments)
+            field: {record[key]: record for record in project.get(field, ())}
+            for field, key in self.RECORD_OPS.values()
+        }
+
+    def _get_pdf(self, projects: List[Dict[str, Any]], project_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        self._index(projects)
+        records = self._records.get(project_id)
+        return records["pdfs"].get(filename) if records else None
 
-    def _get_project_upload_dir(self, project_id: str) -> str:
-        """Directorio de uploads para un proyecto"""
+    def _apply_event(self, projects: List[Dict[str, Any]], event: Dict[str, Any]):
+        """Aplica un evento del log sobre la lista de proyectos (idempotente)"""
+        by_id = self._index(projects)
+        op = event["op"]
+        if op == "create_project":
+            project = event["data"]
+            if project["project_id"] not in by_id:
+                projects.append(project)
+                by_id[project["project_id"]] = project
+                self._records[project["project_id"]] = self._record_index(project)
+            return
+
+        project = by_id.get(event["project_id"])
+        if project is None:
+            return
+
+        if op == "delete_project":
+            # Búsqueda por identidad: se detiene en el primero y no compara dicts
+            for i, p in enumerate(projects):
+                if p is project:
+                    del projects[i]
+                    break
+            del by_id[event["project_id"]]
+            del self._records[event["project_id"]]
+            return
+
+        records = self._records[event["project_id"]]
+        if op == "update_project":
+            project.update(event["data"])
+            if any(field in event["data"] for field in records):
+                self._records[event["project_id"]] = self._record_index(project)
+        elif op in self.RECORD_OPS:
+            field, key = self.RECORD_OPS[op]
+            record = event["data"]
+            if record[key] not in records[field]:
+                project.setdefault(field, []).append(record)
+                records[field][record[key]] = record
+        elif op == "update_pdf":
+            pdf = records["pdfs"].get(event["filename"])
+            if pdf:
+                pdf.update(event["data"])
+        elif op == "remove_pdf":
+            pdf = records["pdfs"].pop(event["filename"], None)
+            if pdf:
+                pdfs = project["pdfs"]
+                for i, p in enumerate(pdfs):
+                    if p is pdf:
+                        del pdfs[i]
+                        break
+        project["updated_at"] = event["updated_at"]
+
+    def get_project_upload_dir(self, project_id: str) -> str:
+        """Directorio de uploads para un proyecto (se crea la primera vez)"""
         path = os.path.join(settings.UPLOADS_DIR, project_id)
-        os.makedirs(path, exist_ok=True)
+        if path not in self._known_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
         return path
 
+    def _move_to_trash(self, path: str):
+        """Renombrado atómico a .trash; el borrado real se hace en segundo plano"""
+        os.makedirs(self.trash_dir, exist_ok=True)
+        target = os.path.join(self.trash_dir, f"{os.path.basename(path)}-{uuid.uuid4().hex[:8]}")
+        os.replace(path, target)
+        self._empty_trash_async()
+
+    def _empty_trash(self):
+        if not os.path.isdir(self.trash_dir):
+            return
+        with os.scandir(self.trash_dir) as entries:
+            for entry in entries:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _empty_trash_async(self):
+        threading.Thread(target=self._empty_trash, daemon=True).start()
+
     def get_all_projects(self) -> List[Dict[str, Any]]:
         """Obtiene todos los proyectos"""
         return self._load_projects()
 
+    def get_all_projects_json(self) -> bytes:
+        """Todos los proyectos ya serializados (cacheado hasta el siguiente cambio)"""
+        return self._store.dump_bytes()
+
     def get_projects_for_user(self, user_id: str) -> List[Dict[str, Any]]:
         """Obtiene proyectos asignados a un usuario"""
         projects = self._load_projects()
@@ -55,11 +167,7 @@ class ProjectService:
 
     def get_project_by_id(self, project_id: str) -> Optional[Dict[str, Any]]:
         """Obtiene un proyecto por ID"""
-        projects = self._load_projects()
-        for p in projects:
-            if p["project_id"] == project_id:
-                return p
-        return None
+        return self._index(self._load_projects()).get(project_id)
 
     def create_project(
         self,
@@ -70,6 +178,7 @@ class ProjectService:
         created_by: str = ""
     ) -> Dict[str, Any]:
         """Crea un nuevo proyecto"""
+        now = datetime.now().isoformat()
         project = {
             "project_id": str(uuid.uuid4()),
             "name": name,
@@ -80,30 +189,31 @@ class ProjectService:
             "pdfs": [],
             "comments": [],
             "created_by": created_by,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "created_at": now,
+            "updated_at": now
         }
 
-        projects = self._load_projects()
-        projects.append(project)
-        self._save_projects(projects)
+        self._store.append({"op": "create_project", "data": project})
 
         # Crear directorio de uploads
-        self._get_project_upload_dir(project["project_id"])
+        self.get_project_upload_dir(project["project_id"])
 
         return project
 
     def update_project(self, project_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Actualiza un proyecto"""
         projects = self._load_projects()
-        for i, p in enumerate(projects):
-            if p["project_id"] == project_id:
-                update_data.pop("project_id", None)
-                projects[i].update(update_data)
-                projects[i]["updated_at"] = datetime.now().isoformat()
-                self._save_projects(projects)
-                return projects[i]
-        return None
+        project = self._index(projects).get(project_id)
+        if not project:
+            return None
+        update_data.pop("project_id", None)
+        self._store.append({
+            "op": "update_project",
+            "project_id": project_id,
+            "data": update_data,
+            "updated_at": datetime.now().isoformat()
+        }, projects)
+        return project
 
     def update_status(self, project_id: str, new_status: str) -> Optional[Dict[str, Any]]:
         """Cambia el estado de un proyecto"""
@@ -114,23 +224,21 @@ class ProjectService:
     def add_pdf(self, project_id: str, filename: str, original_filename: str, file_size: int) -> Optional[Dict[str, Any]]:
         """Registra un PDF subido"""
         projects = self._load_projects()
-        for i, p in enumerate(projects):
-            if p["project_id"] == project_id:
-                pdf_entry = {
-                    "pdf_id": str(uuid.uuid4()),
-                    "filename": filename,
-                    "original_filename": original_filename,
-                    "file_size": file_size,
-                    "uploaded_at": datetime.now().isoformat(),
-                    "preflight_status": "pending",
-                    "preflight_result": None,
-                    "preflight_checked_at": None
-                }
-                projects[i]["pdfs"].append(pdf_entry)
-                projects[i]["updated_at"] = datetime.now().isoformat()
-                self._save_projects(projects)
-                return pdf_entry
-        return None
+        if project_id not in self._index(projects):
+            return None
+        now = datetime.now().isoformat()
+        pdf_entry = {
+            "pdf_id": str(uuid.uuid4()),
+            "filename": filename,
+            "original_filename": original_filename,
+            "file_size": file_size,
+            "uploaded_at": now,
+            "preflight_status": "pending",
+            "preflight_result": None,
+            "preflight_checked_at": None
+        }
+        self._store.append({"op": "add_pdf", "project_id": project_id, "data": pdf_entry, "updated_at": now}, projects)
+        return pdf_entry
 
     def update_pdf_preflight(
         self,
@@ -141,34 +249,39 @@ class ProjectService:
     ) -> bool:
         """Actualiza el resultado preflight de un PDF"""
         projects = self._load_projects()
-        for i, p in enumerate(projects):
-            if p["project_id"] == project_id:
-                for j, pdf in enumerate(p["pdfs"]):
-                    if pdf["filename"] == filename:
-                        projects[i]["pdfs"][j]["preflight_status"] = preflight_status
-                        projects[i]["pdfs"][j]["preflight_result"] = preflight_result
-                        projects[i]["pdfs"][j]["preflight_checked_at"] = datetime.now().isoformat()
-                        projects[i]["updated_at"] = datetime.now().isoformat()
-                        self._save_projects(projects)
-                        return True
-        return False
+        if not self._get_pdf(projects, project_id, filename):
+            return False
+        now = datetime.now().isoformat()
+        self._store.append({
+            "op": "update_pdf",
+            "project_id": project_id,
+            "filename": filename,
+            "data": {
+                "preflight_status": preflight_status,
+                "preflight_result": preflight_result,
+                "preflight_checked_at": now
+            },
+            "updated_at": now
+        }, projects)
+        return True
 
     def remove_pdf(self, project_id: str, filename: str) -> bool:
         """Elimina un PDF de un proyecto"""
         projects = self._load_projects()
-        for i, p in enumerate(projects):
-            if p["project_id"] == project_id:
-                original_len = len(p["pdfs"])
-                projects[i]["pdfs"] = [pdf for pdf in p["pdfs"] if pdf["filename"] != filename]
-                if len(projects[i]["pdfs"]) < original_len:
-                    # Delete file
-                    filepath = os.path.join(self._get_project_upload_dir(project_id), filename)
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    projects[i]["updated_at"] = datetime.now().isoformat()
-                    self._save_projects(projects)
-                    return True
-        return False
+        if not self._get_pdf(projects, project_id, filename):
+            return False
+
+        # Delete file
+        filepath = os.path.join(self.get_project_upload_dir(project_id), filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        self._store.append({
+            "op": "remove_pdf",
+            "project_id": project_id,
+            "filename": filename,
+            "updated_at": datetime.now().isoformat()
+        }, projects)
+        return True
 
     def add_comment(
         self,
@@ -180,35 +293,33 @@ class ProjectService:
     ) -> Optional[Dict[str, Any]]:
         """Añade un comentario a un proyecto"""
         projects = self._load_projects()
-        for i, p in enumerate(projects):
-            if p["project_id"] == project_id:
-                comment = {
-                    "comment_id": str(uuid.uuid4()),
-                    "user_id": user_id,
-                    "username": username,
-                    "message": message,
-                    "pdf_filename": pdf_filename,
-                    "created_at": datetime.now().isoformat()
-                }
-                projects[i]["comments"].append(comment)
-                projects[i]["updated_at"] = datetime.now().isoformat()
-                self._save_projects(projects)
-                return comment
-        return None
+        if project_id not in self._index(projects):
+            return None
+        now = datetime.now().isoformat()
+        comment = {
+            "comment_id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "username": username,
+            "message": message,
+            "pdf_filename": pdf_filename,
+            "created_at": now
+        }
+        self._store.append({"op": "add_comment", "project_id": project_id, "data": comment, "updated_at": now}, projects)
+        return comment
 
     def delete_project(self, project_id: str) -> bool:
         """Elimina un proyecto y sus archivos"""
         projects = self._load_projects()
-        original_len = len(projects)
-        projects = [p for p in projects if p["project_id"] != project_id]
-        if len(projects) < original_len:
-            # Delete upload directory
-            upload_dir = os.path.join(settings.UPLOADS_DIR, project_id)
-            if os.path.exists(upload_dir):
-                shutil.rmtree(upload_dir)
-            self._save_projects(projects)
-            return True
-        return False
+        if project_id not in self._index(projects):
+            return False
+
+        # Delete upload directory
+        upload_dir = os.path.join(settings.UPLOADS_DIR, project_id)
+        self._known_dirs.discard(upload_dir)
+        if os.path.exists(upload_dir):
+            self._move_to_trash(upload_dir)
+        self._store.append({"op": "delete_project", "project_id": project_id}, projects)
+        return True
 
 
 # Instancia global
@@ -2,13 +2,15 @@
 Servicio de magic tokens para acceso remoto.
 Patrón MIS w2p_access_token_service.py adaptado a JSON.
 """
+import base64
 import secrets
-import json
 import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
 
 from config import settings
+from services.json_store import JsonlStore
 
 
 class TokenService:
@@ -16,26 +18,76 @@ class TokenService:
 
     DEFAULT_EXPIRY_HOURS = 72
     DEFAULT_MAX_USES = 10
+    TOKEN_BYTES = 32
+    # Argumentos admitidos por spec en generate_tokens_bulk
+    SPEC_REQUIRED = frozenset({"user_id", "user_email"})
+    SPEC_OPTIONAL = frozenset({"project_id", "expiry_hours", "max_uses"})
 
     def __init__(self):
         self.data_file = os.path.join(settings.DATA_DIR, "tokens.json")
+        self._store = JsonlStore(self.data_file, self._apply_event)
+        self._by_token: Dict[str, Dict[str, Any]] = {}
+        self._tokens_by_user: Dict[str, List[Dict[str, Any]]] = {}
+        self._active_tokens: Dict[str, Dict[str, Any]] = {}
+        self._indexed = None
+        # Prefijo del magic link, constante mientras no cambie la configuración
+        self._login_url = f"{settings.FRONTEND_URL.rstrip('/')}/login?token="
         self._ensure_data_file()
 
     def _ensure_data_file(self):
         os.makedirs(settings.DATA_DIR, exist_ok=True)
-        if not os.path.exists(self.data_file):
+        if not self._store.exists():
             self._save_tokens([])
 
     def _load_tokens(self) -> List[Dict[str, Any]]:
-        try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+        return self._store.load()
 
     def _save_tokens(self, tokens: List[Dict[str, Any]]):
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(tokens, f, indent=2, ensure_ascii=False)
+        self._store.save(tokens)
+
+    def transaction(self):
+        """Agrupa varias mutaciones en una sola escritura: with token_service.transaction(): ..."""
+        return self._store.transaction()
+
+    def _index(self, tokens: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Índices token -> doc, tokens activos y user_id -> docs; se reconstruyen si la lista se recargó de disco"""
+        if tokens is not self._indexed:
+            self._by_token = {t["token"]: t for t in tokens}
+            self._tokens_by_user = {}
+            self._active_tokens = {}
+            for t in tokens:
+                self._backfill_epoch(t)
+                self._tokens_by_user.setdefault(t["user_id"], []).append(t)
+                if t.get("active", True):
+                    self._active_tokens[t["token"]] = t
+            self._indexed = tokens
+        return self._by_token
+
+    @staticmethod
+    def _backfill_epoch(t: Dict[str, Any]):
+        """Tokens antiguos sin expires_at_epoch: se calcula una vez al cargar"""
+        if "expires_at_epoch" not in t:
+            t["expires_at_epoch"] = datetime.fromisoformat(t["expires_at"]).timestamp()
+
+    def _apply_event(self, tokens: List[Dict[str, Any]], event: Dict[str, Any]):
+        """Aplica un evento del log sobre la lista de tokens (idempotente)"""
+        by_token = self._index(tokens)
+        if event["op"] == "generate_token":
+            token_doc = event["data"]
+            if token_doc["token"] not in by_token:
+                self._backfill_epoch(token_doc)
+                tokens.append(token_doc)
+                by_token[token_doc["token"]] = token_doc
+                self._tokens_by_user.setdefault(token_doc["user_id"], []).append(token_doc)
+                if token_doc.get("active", True):
+                    self._active_tokens[token_doc["token"]] = token_doc
+            return
+        # use_token / revoke_token guardan valores absolutos, no incrementos
+        t = by_token.get(event["token"])
+        if t:
+            t.update(event["data"])
+            if not t.get("active", True):
+                self._active_tokens.pop(t["token"], None)
 
     def generate_token(
         self,
@@ -51,29 +103,71 @@ class TokenService:
         Returns:
             Dict con token, url, expiración
         """
-        token = secrets.token_urlsafe(32)
+        return self._generate(
+            secrets.token_urlsafe(self.TOKEN_BYTES), datetime.now(),
+            user_id, user_email, project_id, expiry_hours, max_uses
+        )
+
+    def generate_tokens_bulk(self, specs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Genera varios magic tokens con una sola escritura.
+        specs: dicts con los argumentos de generate_token (user_id, user_email, ...).
+        Se validan todos antes de escribir: un spec inválido no deja tokens a medias.
+        """
+        for i, spec in enumerate(specs):
+            if not isinstance(spec, dict):
+                raise ValueError(f"Spec {i} inválido: se esperaba un dict")
+            missing = self.SPEC_REQUIRED - spec.keys()
+            unknown = spec.keys() - self.SPEC_REQUIRED - self.SPEC_OPTIONAL
+            if missing or unknown:
+                raise ValueError(
+                    f"Spec {i} inválido: faltan {sorted(missing)}, desconocidos {sorted(unknown)}"
+                )
+
+        # Una sola lectura de entropía para todo el lote
+        pool = secrets.token_bytes(self.TOKEN_BYTES * len(specs))
+        now = datetime.now()
+        results = []
+        with self.transaction():
+            for i, spec in enumerate(specs):
+                raw = pool[i * self.TOKEN_BYTES:(i + 1) * self.TOKEN_BYTES]
+                # Misma codificación que secrets.token_urlsafe
+                token = base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+                results.append(self._generate(token, now, **spec))
+        return results
+
+    def _generate(
+        self,
+        token: str,
+        now: datetime,
+        user_id: str,
+        user_email: str,
+        project_id: Optional[str] = None,
+        expiry_hours: Optional[int] = None,
+        max_uses: Optional[int] = None
+    ) -> Dict[str, Any]:
         exp_hours = expiry_hours or self.DEFAULT_EXPIRY_HOURS
         m_uses = max_uses or self.DEFAULT_MAX_USES
-        expires_at = (datetime.now() + timedelta(hours=exp_hours)).isoformat()
+        exp_dt = now + timedelta(hours=exp_hours)
+        expires_at = exp_dt.isoformat()
 
         token_doc = {
             "token": token,
             "user_id": user_id,
             "user_email": user_email,
             "project_id": project_id,
-            "created_at": datetime.now().isoformat(),
+            "created_at": now.isoformat(),
             "expires_at": expires_at,
+            "expires_at_epoch": exp_dt.timestamp(),
             "use_count": 0,
             "max_uses": m_uses,
             "last_used_at": None,
             "active": True
         }
 
-        tokens = self._load_tokens()
-        tokens.append(token_doc)
-        self._save_tokens(tokens)
+        self._store.append({"op": "generate_token", "data": token_doc})
 
-        magic_url = f"{settings.FRONTEND_URL}/login?token={token}"
+        magic_url = self._login_url + token
 
         return {
             "token": token,
@@ -90,58 +184,50 @@ class TokenService:
         Returns dict con user_id y project_id si válido, None si no.
         """
         tokens = self._load_tokens()
-        now = datetime.now()
-
-        for i, t in enumerate(tokens):
-            if t["token"] != token:
-                continue
-
-            if not t.get("active", True):
-                return None
-
-            # Check expiry
-            expires_at = datetime.fromisoformat(t["expires_at"])
-            if now > expires_at:
-                return None
-
-            # Check uses
-            if t["use_count"] >= t["max_uses"]:
-                return None
-
-            # Valid! Increment use
-            tokens[i]["use_count"] += 1
-            tokens[i]["last_used_at"] = now.isoformat()
-            self._save_tokens(tokens)
-
-            return {
-                "valid": True,
-                "user_id": t["user_id"],
-                "user_email": t["user_email"],
-                "project_id": t.get("project_id"),
-                "remaining_uses": t["max_uses"] - t["use_count"] - 1
-            }
+        self._index(tokens)
+        # Inexistentes y revocados quedan fuera del índice de activos
+        t = self._active_tokens.get(token)
+        if t is None:
+            return None
+
+        # Check expiry (epoch guardado: comparación numérica, sin parsear ISO)
+        if time.time() > t["expires_at_epoch"]:
+            return None
+
+        # Check uses
+        if t["use_count"] >= t["max_uses"]:
+            return None
+
+        # Valid! Increment use (diferido: se agrupa con otros usos en un solo write)
+        self._store.append({
+            "op": "use_token",
+            "token": token,
+            "data": {"use_count": t["use_count"] + 1, "last_used_at": datetime.now().isoformat()}
+        }, tokens, defer=True)
 
-        return None
+        return {
+            "valid": True,
+            "user_id": t["user_id"],
+            "user_email": t["user_email"],
+            "project_id": t.get("project_id"),
+            "remaining_uses": t["max_uses"] - t["use_count"] - 1
+        }
 
     def revoke_token(self, token: str) -> bool:
         """Revoca un token"""
         tokens = self._load_tokens()
-        for i, t in enumerate(tokens):
-            if t["token"] == token:
-                tokens[i]["active"] = False
-                self._save_tokens(tokens)
-                return True
-        return False
+        if token not in self._index(tokens):
+            return False
+        self._store.append({"op": "revoke_token", "token": token, "data": {"active": False}}, tokens)
+        return True
 
     def cleanup_expired(self) -> int:
-        """Elimina tokens expirados"""
+        """Elimina tokens expirados (sin tocar disco si no hay ninguno); los índices se rehacen con la nueva lista"""
         tokens = self._load_tokens()
-        now = datetime.now()
+        self._index(tokens)
+        now = time.time()
         original = len(tokens)
-        tokens = [
-            t for t in tokens
-            if datetime.fromisoformat(t["expires_at"]) > now
-        ]
+        tokens = [t for t in tokens if t["expires_at_epoch"] > now]
         removed = original - len(tokens)
         if removed > 0:
             self._save_tokens(tokens)
@@ -149,15 +235,15 @@ class TokenService:
 
     def get_tokens_for_user(self, user_id: str) -> List[Dict[str, Any]]:
         """Obtiene tokens activos de un usuario"""
-        tokens = self._load_tokens()
-        now = datetime.now()
-        return [
-            {k: v for k, v in t.items() if k != "token"}  # No exponer el token completo
-            for t in tokens
-            if t["user_id"] == user_id
-            and t.get("active", True)
-            and datetime.fromisoformat(t["expires_at"]) > now
-        ]
+        self._index(self._load_tokens())
+        now = time.time()
+        result = []
+        for t in self._tokens_by_user.get(user_id, []):
+            if t["token"] in self._active_tokens and t["expires_at_epoch"] > now:
+                public = dict(t)
+                del public["token"]  # No exponer el token completo
+                result.append(public)
+        return result
 
 
 # Instancia global
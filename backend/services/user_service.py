@@ -3,13 +3,20 @@ Servicio de usuarios con persistencia JSON.
 Patrón MIS user_service.py adaptado a ficheros JSON.
 """
 import uuid
-import json
 import os
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 
 from config import settings
 from services.auth_service import hash_password
+from services.json_store import JsonlStore
+
+
+def _public_user(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Copia sin password_hash (copia en C + pop, sin recorrer las claves en Python)"""
+    public = dict(user)
+    public.pop("password_hash", None)
+    return public
 
 
 class UserService:
@@ -17,27 +24,76 @@ class UserService:
 
     def __init__(self):
         self.data_file = os.path.join(settings.DATA_DIR, "users.json")
+        self._store = JsonlStore(self.data_file, self._apply_event)
+        self._by_id: Dict[str, Dict[str, Any]] = {}
+        self._by_username: Dict[str, Dict[str, Any]] = {}
+        # email en minúsculas -> usuario; se construye bajo demanda
+        self._by_email_lower: Optional[Dict[str, Dict[str, Any]]] = None
+        # Vista sin password_hash; se invalida con cada evento o recarga
+        self._public_users: Optional[List[Dict[str, Any]]] = None
+        self._indexed = None
         self._ensure_data_file()
         self._ensure_admin()
 
     def _ensure_data_file(self):
         """Crea el fichero de datos si no existe"""
         os.makedirs(settings.DATA_DIR, exist_ok=True)
-        if not os.path.exists(self.data_file):
+        if not self._store.exists():
             self._save_users([])
 
     def _load_users(self) -> List[Dict[str, Any]]:
-        """Carga usuarios del fichero JSON"""
-        try:
-            with open(self.data_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+        """Carga usuarios (snapshot + log, cacheado en memoria)"""
+        return self._store.load()
 
     def _save_users(self, users: List[Dict[str, Any]]):
-        """Guarda usuarios en el fichero JSON"""
-        with open(self.data_file, "w", encoding="utf-8") as f:
-            json.dump(users, f, indent=2, ensure_ascii=False)
+        """Guarda un snapshot completo de usuarios"""
+        self._store.save(users)
+
+    def transaction(self):
+        """Agrupa varias mutaciones en una sola escritura: with user_service.transaction(): ..."""
+        return self._store.transaction()
+
+    def _index(self, users: List[Dict[str, Any]]):
+        """Índices por user_id y username; se reconstruyen si la lista se recargó de disco"""
+        if users is not self._indexed:
+            self._by_id = {u["user_id"]: u for u in users}
+            self._by_username = {u["username"]: u for u in users}
+            self._by_email_lower = None
+            self._public_users = None
+            self._indexed = users
+
+    def _apply_event(self, users: List[Dict[str, Any]], event: Dict[str, Any]):
+        """Aplica un evento del log sobre la lista de usuarios (idempotente)"""
+        self._index(users)
+        self._public_users = None
+        op = event["op"]
+        if op == "create_user":
+            user = event["data"]
+            if user["user_id"] not in self._by_id:
+                users.append(user)
+                self._by_id[user["user_id"]] = user
+                self._by_username[user["username"]] = user
+                if self._by_email_lower is not None:
+                    self._by_email_lower.setdefault(user.get("email", "").lower(), user)
+            return
+
+        user = self._by_id.get(event["user_id"])
+        if user is None:
+            return
+        if op == "update_user":
+            self._by_username.pop(user["username"], None)
+            user.update(event["data"])
+            self._by_username[user["username"]] = user
+            if "email" in event["data"]:
+                self._by_email_lower = None
+        elif op == "delete_user":
+            for i, u in enumerate(users):
+                if u is user:
+                    del users[i]
+                    break
+            del self._by_id[user["user_id"]]
+            self._by_username.pop(user["username"], None)
+            self._by_email_lower = None
 
     def _ensure_admin(self):
         """Crea el usuario admin por defecto si no existe"""
@@ -55,31 +111,31 @@ class UserService:
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Obtiene todos los usuarios (sin password_hash)"""
         users = self._load_users()
-        return [{k: v for k, v in u.items() if k != "password_hash"} for u in users]
+        self._index(users)
+        if self._public_users is None:
+            self._public_users = [_public_user(u) for u in users]
+        return self._public_users
 
     def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Obtiene un usuario por ID"""
-        users = self._load_users()
-        for user in users:
-            if user["user_id"] == user_id:
-                return user
-        return None
+        self._index(self._load_users())
+        return self._by_id.get(user_id)
 
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Obtiene un usuario por username"""
-        users = self._load_users()
-        for user in users:
-            if user["username"] == username:
-                return user
-        return None
+        self._index(self._load_users())
+        return self._by_username.get(username)
 
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Obtiene un usuario por email"""
         users = self._load_users()
-        for user in users:
-            if user.get("email", "").lower() == email.lower():
-                return user
-        return None
+        self._index(users)
+        if self._by_email_lower is None:
+            self._by_email_lower = {}
+            for user in users:
+                # setdefault: con emails repetidos gana el primero, como en el recorrido lineal
+                self._by_email_lower.setdefault(user.get("email", "").lower(), user)
+        return self._by_email_lower.get(email.lower())
 
     def create_user(
         self,
@@ -96,6 +152,7 @@ class UserService:
         if email and self.get_user_by_email(email):
             raise ValueError(f"El email '{email}' ya está registrado")
 
+        now = datetime.now().isoformat()
         user = {
             "user_id": str(uuid.uuid4()),
             "username": username,
@@ -104,52 +161,46 @@ class UserService:
             "role": role,
             "full_name": full_name,
             "active": True,
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
+            "created_at": now,
+            "updated_at": now
         }
 
-        users = self._load_users()
-        users.append(user)
-        self._save_users(users)
+        self._store.append({"op": "create_user", "data": user})
 
         # Devolver sin password_hash
-        return {k: v for k, v in user.items() if k != "password_hash"}
+        return _public_user(user)
 
     def update_user(self, user_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Actualiza un usuario"""
         users = self._load_users()
-        for i, user in enumerate(users):
-            if user["user_id"] == user_id:
-                # No permitir cambiar user_id ni password_hash directamente
-                for key in ["user_id", "password_hash"]:
-                    update_data.pop(key, None)
+        self._index(users)
+        user = self._by_id.get(user_id)
+        if not user:
+            return None
+
+        # No permitir cambiar user_id ni password_hash directamente
+        for key in ["user_id", "password_hash"]:
+            update_data.pop(key, None)
 
-                if "password" in update_data:
-                    users[i]["password_hash"] = hash_password(update_data.pop("password"))
+        if "password" in update_data:
+            update_data["password_hash"] = hash_password(update_data.pop("password"))
 
-                users[i].update(update_data)
-                users[i]["updated_at"] = datetime.now().isoformat()
-                self._save_users(users)
-                return {k: v for k, v in users[i].items() if k != "password_hash"}
-        return None
+        update_data["updated_at"] = datetime.now().isoformat()
+        self._store.append({"op": "update_user", "user_id": user_id, "data": update_data}, users)
+        return _public_user(user)
 
     def delete_user(self, user_id: str) -> bool:
         """Elimina un usuario"""
         users = self._load_users()
-        original_len = len(users)
-        users = [u for u in users if u["user_id"] != user_id]
-        if len(users) < original_len:
-            self._save_users(users)
-            return True
-        return False
+        self._index(users)
+        if user_id not in self._by_id:
+            return False
+        self._store.append({"op": "delete_user", "user_id": user_id}, users)
+        return True
 
     def get_clients(self) -> List[Dict[str, Any]]:
         """Obtiene solo los usuarios con rol 'client'"""
-        users = self._load_users()
-        return [
-            {k: v for k, v in u.items() if k != "password_hash"}
-            for u in users if u.get("role") == "client"
-        ]
+        return [u for u in self.get_all_users() if u.get("role") == "client"]
 
 
 # Instancia global